@@ -2,7 +2,11 @@
 #Defines the workflow, nodes, and routing logic.
 
 
-from langgraph.graph import StateGraph, END
+import functools
+from collections import OrderedDict
+
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import StateGraph, START, END
 from agent.state import BookingState
 from agent.nodes import (
     router_node,
@@ -17,9 +21,34 @@ from agent.nodes import (
     handle_sms_error_node
 )
 
+# Most conversation threads kept in memory at once; abandoned sessions age out
+MAX_THREADS = 500
+
+
+#In-memory checkpointer that drops the least recently used threads past max_threads.
+class BoundedMemorySaver(MemorySaver):
+
+    def __init__(self, max_threads: int = MAX_THREADS):
+        super().__init__()
+        self.max_threads = max_threads
+        self._recent: OrderedDict = OrderedDict()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        self._recent[thread_id] = None
+        self._recent.move_to_end(thread_id)
+        while len(self._recent) > self.max_threads:
+            self.delete_thread(next(iter(self._recent)))
+        return super().put(config, checkpoint, metadata, new_versions)
+
+    def delete_thread(self, thread_id: str) -> None:
+        self._recent.pop(thread_id, None)
+        super().delete_thread(thread_id)
+
+
 #Route based on booking creation success.
 def check_booking_success(state: BookingState) -> str:
-    booking_ref = state.get("booking_ref")
+    booking_ref = state.booking_ref
     if booking_ref:
         return "send_sms"
     else:
@@ -28,17 +57,21 @@ def check_booking_success(state: BookingState) -> str:
 
 #Route based on SMS sending success.
 def check_sms_success(state: BookingState) -> str:
-    last_message = state["messages"][-1].content
-    if "sent a confirmation SMS" in last_message:
+    if state.sms_sent:
         return END
     else:
         return "handle_sms_error"
 
 
+@functools.lru_cache(maxsize=1)
 def build_graph() -> StateGraph:
     """
     Build and compile the LangGraph state machine.
 
+    The compiled graph is built once per process and shared. Conversation state is
+    kept by an in-memory checkpointer, one thread per session: callers pass
+    config={"configurable": {"thread_id": session_id}} and only the new messages.
+
     Graph flow:
     START → greet → collect_info → [all fields filled?]
                          ↑              ↓ yes
@@ -61,7 +94,6 @@ def build_graph() -> StateGraph:
     workflow = StateGraph(BookingState)
 
     # Add nodes
-    workflow.add_node("router", lambda state: state)  # Dummy node, routing done via conditional edge
     workflow.add_node("collect_info", collect_info_node)
     workflow.add_node("confirm", confirm_node)
     workflow.add_node("handle_confirmation", handle_confirmation_node)
@@ -70,12 +102,10 @@ def build_graph() -> StateGraph:
     workflow.add_node("handle_booking_error", handle_booking_error_node)
     workflow.add_node("handle_sms_error", handle_sms_error_node)
 
-    # Set entry point - router decides where to go
-    workflow.set_entry_point("router")
-
-    # Router conditional edge
+    # Entry routing runs as a conditional edge from START, so no pass-through node
+    # (and its extra superstep) is executed on every turn
     workflow.add_conditional_edges(
-        "router",
+        START,
         router_node,
         {
             "collect_info": "collect_info",
@@ -130,5 +160,6 @@ def build_graph() -> StateGraph:
     workflow.add_edge("handle_booking_error", END)
     workflow.add_edge("handle_sms_error", END)
 
-    # Compile the graph
-    return workflow.compile()
+    # Compile the graph; the checkpointer persists state between turns of a thread.
+    # Callers delete a thread when they rotate its session id.
+    return workflow.compile(checkpointer=BoundedMemorySaver())
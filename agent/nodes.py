@@ -1,29 +1,42 @@
 #Node functions for the restaurant booking agent.
 #Each node handles a specific part of the booking workflow.
 
+import asyncio
+import atexit
+import functools
 import os
-from typing import Optional, Literal
-from datetime import datetime, timedelta
-from dotenv import load_dotenv
+from typing import Dict, Optional, Literal
+from datetime import date, timedelta
 
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langgraph.types import StreamWriter
 from pydantic import BaseModel, Field
-from langfuse.langchain import CallbackHandler
+import tiktoken
 
 from agent.state import BookingState
 from apis.booking import create_booking
 from apis.sms import send_sms
 
-# Load environment variables
-load_dotenv()
+# Read once at import; entry points (main.py, streamlit_app.py) load .env beforehand
+MODEL_NAME = os.getenv("MODEL_NAME", "gpt-4o-mini")
 
-# Initialize LangFuse callback handler
-langfuse_handler = CallbackHandler()
+# Initialize LangFuse tracing only when configured. Spans are batched and exported
+# from LangFuse's background thread rather than flushed on every LLM call.
+if os.getenv("LANGFUSE_PUBLIC_KEY"):
+    from langfuse import Langfuse
+    from langfuse.langchain import CallbackHandler
+
+    langfuse_client = Langfuse(flush_at=50, flush_interval=5.0)
+    langfuse_handler = CallbackHandler()
+    atexit.register(langfuse_client.flush)  # drain pending spans on shutdown
+    llm_callbacks = [langfuse_handler]
+else:
+    llm_callbacks = []
 
 # Initialize LLM
 llm = ChatOpenAI(
-    model=os.getenv("MODEL_NAME", "gpt-4o-mini"),
+    model=MODEL_NAME,
     temperature=0.7
 )
 
@@ -54,6 +67,196 @@ class ConfirmationResponse(BaseModel):
     )
 
 
+#Build a JSON schema OpenAI accepts in strict mode (no null defaults).
+#LangChain marks every field required and disallows extra properties when strict=True.
+def _strict_json_schema(model: type[BaseModel]) -> dict:
+    schema = model.model_json_schema()
+    for prop in schema["properties"].values():
+        prop.pop("default", None)
+    return schema
+
+
+# Precomputed once at import; the schema never changes between turns
+BOOKING_INFO_SCHEMA = _strict_json_schema(BookingInfo)
+
+# Structured-output bindings are built once; the schemas never change between turns.
+# Booking info is bound with its JSON schema so .stream() yields partial dicts, and
+# strict mode has OpenAI guarantee schema-conforming output server-side.
+llm_booking_info = llm.with_structured_output(BOOKING_INFO_SCHEMA, strict=True)
+llm_confirmation = llm.with_structured_output(ConfirmationResponse)
+
+
+# ===== System Prompts =====
+# Kept static so OpenAI's prefix cache sees identical leading tokens every turn.
+# Per-turn context (today's date, collected fields) is sent in a separate message.
+
+COLLECT_INFO_SYSTEM_PROMPT = """You are a friendly restaurant booking assistant.
+
+Your job is to extract booking information from the user's messages and ask for anything that's missing.
+
+COLLECT IN ORDER (one at a time):
+1. Restaurant → 2. Date → 3. Time → 4. Party size → 5. Name → 6. Phone
+
+
+Guidelines:
+- Extract information naturally from conversation
+- When you ask "What time?" and user says just a number (1-12), interpret as PM like "2" = 14:00, "7" = 19:00, "10" = 22:00 etc
+- For cases like "2pm" or "14:00", use as-is
+- Question unusual times: "2am is unusual. Did you mean 2pm?"
+- ACCEPT bookings for today and future dates (today's date is given in the context below)
+- ONLY REJECT dates that are actually in the past (before today)
+- If date is in the past (before today), say: "That date has already passed. Please choose a future date."
+- For dates 6+ months out, confirm: "Just to confirm, that's [month/year] - quite a ways out. Is that correct?"
+- For dates within normal booking range (next few months), just accept them naturally without comment
+- Don't assume meal type (breakfast/lunch/dinner)
+- Ensure party size is reasonable (1-20 people)
+- Handle updates gracefully (if user says "actually make it 8pm", update the time)
+- Ask for the NEXT missing field in the sequence, one at a time
+
+The current booking is given as a header line (restaurant|date|time|party|name|phone)
+followed by one pipe-separated row of values in the same order; "-" marks a missing field.
+In values, "\\|" is a literal "|", "\\\\" a literal backslash, and "\\-" a literal "-" (not missing).
+
+CRITICAL: When user says "change X to Y", extract the NEW value for X in proper format.
+Example: "change time to 7pm" → extract time="19:00" (not a description)
+For fields not mentioned, return null."""
+
+
+CONFIRMATION_SYSTEM_PROMPT = """Interpret the user's response to booking confirmation.
+
+They were shown booking details and asked if everything looks correct.
+
+- If they confirm (yes, correct, looks good, yep, etc.) → user_wants_to_proceed = True, requested_changes = null
+- If they say "no" without specifying changes → user_wants_to_proceed = False, requested_changes = "Please specify what changes you would like to make to the booking."
+- If they want specific changes (change time, different restaurant, etc.) → user_wants_to_proceed = False, requested_changes = describe what they want to change
+- If unclear/uncertain ("maybe", "i guess", "not sure", "um") → user_wants_to_proceed = False, requested_changes = "I need a clear yes or no. Do the booking details look correct to you?"
+
+ALWAYS provide a helpful requested_changes message when user_wants_to_proceed = False."""
+
+
+# ===== Message Templates =====
+# Pre-bound str.format methods; nodes call them with the current state as `s`.
+
+_CONFIRM_TMPL = """Great! Let me confirm the details of your booking:
+
+Restaurant: {s.restaurant_name}
+Date: {s.date}
+Time: {s.time}
+Party size: {s.party_size} people
+Name: {s.customer_name}
+Phone: {s.phone}
+
+Does everything look correct? (You can say 'yes' to confirm, or let me know if you'd like to change anything)""".format
+
+_BOOKING_ERROR_TMPL = """I'm having trouble creating your booking right now. This might be a temporary issue with the booking system.
+
+I've recorded your details:
+- Restaurant: {s.restaurant_name}
+- Date: {s.date} at {s.time}
+- Party size: {s.party_size}
+- Name: {s.customer_name}
+- Phone: {s.phone}
+
+Can I have someone from the restaurant call you back to confirm the booking?""".format
+
+_SMS_TMPL = """Your booking is confirmed!
+
+Restaurant: {s.restaurant_name}
+Date: {s.date}
+Time: {s.time}
+Party: {s.party_size} people
+Ref: {s.booking_ref}
+
+See you there! Reply CANCEL to modify.""".format
+
+_SMS_ERROR_TMPL = """Your booking is confirmed!
+
+However, I couldn't send the confirmation SMS. Please save this information:
+
+Restaurant: {s.restaurant_name}
+Date: {s.date}
+Time: {s.time}
+Party size: {s.party_size}
+Booking Reference: {s.booking_ref}
+
+Please screenshot or write down your booking reference: {s.booking_ref}""".format
+
+
+# ===== Confirmation Fast Path & Cache =====
+# Obvious yes/no replies are classified locally without an LLM call.
+# Anything else is interpreted by the LLM. The cache is shared by every session and
+# keyed only on the normalized reply, so it only keeps context-free outcomes: a plain
+# "proceed" or one of the canned replies from CONFIRMATION_SYSTEM_PROMPT. Change
+# descriptions are written from this session's booking and are never cached.
+
+_AFFIRM = {"yes", "y", "yep", "yeah", "sure", "ok", "okay", "correct", "looks good", "confirm", "proceed"}
+_DENY = {"no", "n", "nope", "cancel"}
+
+_NEEDS_CHANGES = "Please specify what changes you would like to make to the booking."
+_UNCLEAR = "I need a clear yes or no. Do the booking details look correct to you?"
+_CANNED_REPLIES = {_NEEDS_CHANGES, _UNCLEAR}
+
+CONFIRMATION_CACHE_MAX_SIZE = 256
+
+_confirmation_cache: Dict[str, ConfirmationResponse] = {}
+
+
+#Normalize a user reply for fast-path and cache lookups
+def _normalize_reply(text: str) -> str:
+    return " ".join(text.strip().lower().rstrip("!.?").split())
+
+
+#Look up a cached interpretation, falling back to the LLM and caching the result
+def _interpret_confirmation(key: str, state: BookingState) -> ConfirmationResponse:
+    cached = _confirmation_cache.get(key)
+    if cached is not None:
+        return cached
+
+    messages = [SystemMessage(content=CONFIRMATION_SYSTEM_PROMPT)] + state.messages
+    response: ConfirmationResponse = llm_confirmation.invoke(messages, config={"callbacks": llm_callbacks})
+
+    context_free = response.user_wants_to_proceed or response.requested_changes in _CANNED_REPLIES
+    if context_free and len(_confirmation_cache) < CONFIRMATION_CACHE_MAX_SIZE:
+        _confirmation_cache[key] = response
+
+    return response
+
+
+# ===== Conversation History =====
+# Long sessions are capped so per-turn prompt size (and TTFT) stays bounded.
+# The collected booking fields travel in the dynamic context, so older turns can go.
+
+HISTORY_TOKEN_LIMIT = 3000
+HISTORY_KEEP_MESSAGES = 10
+
+
+#Load the tokenizer once, on first use (tiktoken may download the encoding)
+@functools.lru_cache(maxsize=1)
+def _token_encoder() -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(MODEL_NAME)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+#Keep only the most recent messages once the history exceeds the token budget
+def _trim_history(messages: list) -> list:
+    if len(messages) <= HISTORY_KEEP_MESSAGES:
+        return messages
+
+    encoder = _token_encoder()
+    total = sum(len(encoder.encode(message.content)) for message in messages)
+    if total <= HISTORY_TOKEN_LIMIT:
+        return messages
+
+    omitted = len(messages) - HISTORY_KEEP_MESSAGES
+    note = SystemMessage(
+        content=f"{omitted} earlier messages were omitted. "
+        "The current booking information above reflects everything collected so far."
+    )
+    return [note] + messages[-HISTORY_KEEP_MESSAGES:]
+
+
 # ===== Node Functions =====
 
 def greet_node(state: BookingState) -> BookingState:
@@ -78,88 +281,75 @@ def greet_node(state: BookingState) -> BookingState:
 #Route to appropriate node
 def router_node(state: BookingState) -> str:
 
-    if state.get("awaiting_confirmation"):
+    if state.awaiting_confirmation:
         return "handle_confirmation"
     else:
         return "collect_info"
 
-#Collect booking information 
-def collect_info_node(state: BookingState) -> BookingState:
+#Field order of the compact booking row; declared once in COLLECT_INFO_SYSTEM_PROMPT
+_ONTO_FIELDS = ("restaurant_name", "date", "time", "party_size", "customer_name", "phone")
+_ONTO_HEADER = "restaurant|date|time|party|name|phone"
 
 
-    # Get current date for context
-    today = datetime.now()
-    today_str = today.strftime("%Y-%m-%d")
-    day_of_week = today.strftime("%A")
-    today_full = today.strftime("%A, %B %d, %Y")
+#Escape one value so user text can't add columns or rows, or read as the missing marker
+def _onto_cell(value) -> str:
+    if not value:
+        return "-"
+    text = " ".join(str(value).replace("\\", "\\\\").replace("|", "\\|").split())
+    return "\\-" if text == "-" else text
 
-    # system prompt
-    system_prompt = f"""You are a friendly restaurant booking assistant. Today is {today_full}.
 
-DATES: "today"={today_str}, "tomorrow"={(today + timedelta(days=1)).strftime('%Y-%m-%d')}, "next week [day]"=7+ days out. Format: YYYY-MM-DD.
+#Encode the collected fields as a header plus one positional row instead of labelled lines
+def booking_state_to_onto(state: BookingState) -> str:
+    row = "|".join(_onto_cell(getattr(state, field)) for field in _ONTO_FIELDS)
+    return f"{_ONTO_HEADER}\n{row}"
 
 
+#Format the date anchors for the prompt; only changes once a day, so it's cached
+@functools.lru_cache(maxsize=1)
+def _date_context(today: date) -> str:
+    today_str = today.strftime("%Y-%m-%d")
+    tomorrow_str = (today + timedelta(days=1)).strftime("%Y-%m-%d")
+    today_full = today.strftime("%A, %B %d, %Y")
 
-Your job is to extract booking information from the user's messages and ask for anything that's missing.
-
-COLLECT IN ORDER (one at a time):
-1. Restaurant → 2. Date → 3. Time → 4. Party size → 5. Name → 6. Phone
-
+    return f"""Today is {today_full}.
 
-Guidelines:
-- Extract information naturally from conversation
-- When you ask "What time?" and user says just a number (1-12), interpret as PM like "2" = 14:00, "7" = 19:00, "10" = 22:00 etc
-- For cases like "2pm" or "14:00", use as-is
-- Question unusual times: "2am is unusual. Did you mean 2pm?"
-- ACCEPT bookings for today ({today_str}) and future dates
-- ONLY REJECT dates that are actually in the past (before {today_str})
-- If date is in the past (before {today_str}), say: "That date has already passed. Please choose a future date."
-- For dates 6+ months out, confirm: "Just to confirm, that's [month/year] - quite a ways out. Is that correct?"
-- For dates within normal booking range (next few months), just accept them naturally without comment
-- Don't assume meal type (breakfast/lunch/dinner)
-- Ensure party size is reasonable (1-20 people)
-- Handle updates gracefully (if user says "actually make it 8pm", update the time)
-- Ask for the NEXT missing field in the sequence, one at a time
+DATES: "today"={today_str}, "tomorrow"={tomorrow_str}, "next week [day]"=7+ days out. Format: YYYY-MM-DD."""
 
-CRITICAL: When user says "change X to Y", extract the NEW value for X in proper format.
-Example: "change time to 7pm" → extract time="19:00" (not a description)
-For fields not mentioned, return null.
+#Collect booking information 
+def collect_info_node(state: BookingState, writer: StreamWriter = lambda _: None) -> BookingState:
 
 
-Current booking information:
-- Restaurant: {state.get('restaurant_name') or 'MISSING'}
-- Date: {state.get('date') or 'MISSING'}
-- Time: {state.get('time') or 'MISSING'}
-- Party size: {state.get('party_size') or 'MISSING'}
-- Name: {state.get('customer_name') or 'MISSING'}
-- Phone: {state.get('phone') or 'MISSING'}
+    # Dynamic context goes after the static prompt so the prefix stays cacheable
+    dynamic_context = f"""{_date_context(date.today())}
 
+Current booking:
+{booking_state_to_onto(state)}
 """
 
     # Build messages for LLM
-    messages = [SystemMessage(content=system_prompt)] + state["messages"]
+    messages = [
+        SystemMessage(content=COLLECT_INFO_SYSTEM_PROMPT),
+        SystemMessage(content=dynamic_context),
+    ] + _trim_history(state.messages)
 
     # Call LLM with structured output
-    llm_with_structure = llm.with_structured_output(BookingInfo)
-    response: BookingInfo = llm_with_structure.invoke(messages, config={"callbacks": [langfuse_handler]})
-
-    # Update state with extracted information (only update non-null values)
-    updates = {
-        "messages": [AIMessage(content=response.response_message)]
-    }
-
-    if response.restaurant_name:
-        updates["restaurant_name"] = response.restaurant_name
-    if response.date:
-        updates["date"] = response.date
-    if response.time:
-        updates["time"] = response.time
-    if response.party_size:
-        updates["party_size"] = response.party_size
-    if response.customer_name:
-        updates["customer_name"] = response.customer_name
-    if response.phone:
-        updates["phone"] = response.phone
+    # Stream the reply so the user sees response_message as it is generated
+    partial: dict = {}
+    streamed = ""
+    for partial in llm_booking_info.stream(messages, config={"callbacks": llm_callbacks}):
+        text = partial.get("response_message") or ""
+        if len(text) > len(streamed) and text.startswith(streamed):
+            writer({"response_delta": text[len(streamed):]})
+            streamed = text
+
+    response = BookingInfo.model_validate(partial)
+    if response.response_message.startswith(streamed) and response.response_message != streamed:
+        writer({"response_delta": response.response_message[len(streamed):]})
+
+    # Update state with extracted information (skip empty values like "" or 0)
+    updates = {k: v for k, v in response.model_dump(exclude={"response_message"}).items() if v}
+    updates["messages"] = [AIMessage(content=response.response_message)]
 
     return updates
 
@@ -167,12 +357,12 @@ Current booking information:
 def should_continue_collecting(state: BookingState) -> Literal["confirm", "collect"]:
 
     required_fields = [
-        state.get("restaurant_name"),
-        state.get("date"),
-        state.get("time"),
-        state.get("party_size"),
-        state.get("customer_name"),
-        state.get("phone")
+        state.restaurant_name,
+        state.date,
+        state.time,
+        state.party_size,
+        state.customer_name,
+        state.phone
     ]
 
     all_filled = all(field is not None for field in required_fields)
@@ -187,16 +377,7 @@ def should_continue_collecting(state: BookingState) -> Literal["confirm", "colle
 def confirm_node(state: BookingState) -> BookingState:
 
 
-    confirmation_message = f"""Great! Let me confirm the details of your booking:
-
-Restaurant: {state['restaurant_name']}
-Date: {state['date']}
-Time: {state['time']}
-Party size: {state['party_size']} people
-Name: {state['customer_name']}
-Phone: {state['phone']}
-
-Does everything look correct? (You can say 'yes' to confirm, or let me know if you'd like to change anything)"""
+    confirmation_message = _CONFIRM_TMPL(s=state)
 
     return {
         "messages": [AIMessage(content=confirmation_message)],
@@ -207,21 +388,21 @@ Does everything look correct? (You can say 'yes' to confirm, or let me know if y
 #handle user's confirmation response
 def handle_confirmation_node(state: BookingState) -> BookingState:
 
+    reply = _normalize_reply(state.messages[-1].content)
 
-    system_prompt = """Interpret the user's response to booking confirmation.
-
-They were shown booking details and asked if everything looks correct.
-
-- If they confirm (yes, correct, looks good, yep, etc.) → user_wants_to_proceed = True, requested_changes = null
-- If they say "no" without specifying changes → user_wants_to_proceed = False, requested_changes = "Please specify what changes you would like to make to the booking."
-- If they want specific changes (change time, different restaurant, etc.) → user_wants_to_proceed = False, requested_changes = describe what they want to change
-- If unclear/uncertain ("maybe", "i guess", "not sure", "um") → user_wants_to_proceed = False, requested_changes = "I need a clear yes or no. Do the booking details look correct to you?"
-
-ALWAYS provide a helpful requested_changes message when user_wants_to_proceed = False."""
+    if reply in _AFFIRM:
+        return {
+            "user_confirmed": True,
+            "awaiting_confirmation": False
+        }
+    if reply in _DENY:
+        return {
+            "user_confirmed": False,
+            "awaiting_confirmation": False,
+            "messages": [AIMessage(content=_NEEDS_CHANGES)]
+        }
 
-    messages = [SystemMessage(content=system_prompt)] + state["messages"]
-    llm_with_structure = llm.with_structured_output(ConfirmationResponse)
-    response: ConfirmationResponse = llm_with_structure.invoke(messages, config={"callbacks": [langfuse_handler]})
+    response = _interpret_confirmation(reply, state)
 
 
     # If user didn't confirm, provide helpful message
@@ -240,22 +421,22 @@ ALWAYS provide a helpful requested_changes message when user_wants_to_proceed =
 
 #Route based on user confirmation.
 def check_confirmation_routing(state: BookingState) -> Literal["proceed", "collect"]:
-    if state.get("user_confirmed"):
+    if state.user_confirmed:
         return "proceed"
     else:
         return "collect"
 
 #Call the mock booking API to create the reservation.
-def create_booking_node(state: BookingState) -> BookingState:
+async def create_booking_node(state: BookingState) -> BookingState:
 
 
-    result = create_booking(
-        restaurant=state["restaurant_name"],
-        date=state["date"],
-        time=state["time"],
-        party_size=state["party_size"],
-        name=state["customer_name"],
-        phone=state["phone"]
+    result = await create_booking(
+        restaurant=state.restaurant_name,
+        date=state.date,
+        time=state.time,
+        party_size=state.party_size,
+        name=state.customer_name,
+        phone=state.phone
     )
 
     if result["success"]:
@@ -269,81 +450,43 @@ def create_booking_node(state: BookingState) -> BookingState:
         return {"booking_ref": None}
 
 
+#Tell the user the booking failed; the API has already retried with backoff.
 def handle_booking_error_node(state: BookingState) -> BookingState:
-    """Handle booking API failures with retry and graceful error message."""
-
-    # Retry once
-    result = create_booking(
-        restaurant=state["restaurant_name"],
-        date=state["date"],
-        time=state["time"],
-        party_size=state["party_size"],
-        name=state["customer_name"],
-        phone=state["phone"]
-    )
 
-    if result["success"]:
-        return {
-            "booking_ref": result["booking_ref"],
-            "messages": [AIMessage(content=f"Success! Your booking has been created. Reference: {result['booking_ref']}")]
-        }
-    else:
-        error_message = f"""I'm having trouble creating your booking right now. This might be a temporary issue with the booking system.
+    error_message = _BOOKING_ERROR_TMPL(s=state)
 
-I've recorded your details:
-- Restaurant: {state['restaurant_name']}
-- Date: {state['date']} at {state['time']}
-- Party size: {state['party_size']}
-- Name: {state['customer_name']}
-- Phone: {state['phone']}
-
-Can I have someone from the restaurant call you back to confirm the booking?"""
-
-        return {
-            "messages": [AIMessage(content=error_message)],
-            "conversation_complete": True
-        }
+    return {
+        "messages": [AIMessage(content=error_message)],
+        "conversation_complete": True
+    }
 
 
 #Send SMS confirmation to the customer.
-def send_sms_node(state: BookingState) -> BookingState:
-
-    sms_message = f"""Your booking is confirmed!
-
-Restaurant: {state['restaurant_name']}
-Date: {state['date']}
-Time: {state['time']}
-Party: {state['party_size']} people
-Ref: {state['booking_ref']}
+async def send_sms_node(state: BookingState) -> BookingState:
 
-See you there! Reply CANCEL to modify."""
+    sms_message = _SMS_TMPL(s=state)
 
-    result = send_sms(phone=state["phone"], message=sms_message)
+    # Gathered so further post-booking tasks can run alongside the SMS send
+    (result,) = await asyncio.gather(
+        send_sms(phone=state.phone, message=sms_message),
+        return_exceptions=True
+    )
 
-    if result["success"]:
+    if isinstance(result, dict) and result["success"]:
         return {
+            "sms_sent": True,
             "messages": [AIMessage(content="I've sent a confirmation SMS to your phone. Your booking is all set!")],
             "conversation_complete": True
         }
     else:
         # Will be handled by error node
-        return {}
+        return {"sms_sent": False}
 
 
 #Handle SMS API failures and inform the user that the booking is confirmed.
 def handle_sms_error_node(state: BookingState) -> BookingState:
 
-    error_message = f"""Your booking is confirmed!
-
-However, I couldn't send the confirmation SMS. Please save this information:
-
-Restaurant: {state['restaurant_name']}
-Date: {state['date']}
-Time: {state['time']}
-Party size: {state['party_size']}
-Booking Reference: {state['booking_ref']}
-
-Please screenshot or write down your booking reference: {state['booking_ref']}"""
+    error_message = _SMS_ERROR_TMPL(s=state)
 
     return {
         "messages": [AIMessage(content=error_message)],
@@ -2,25 +2,30 @@
 #Maintains conversation context and booking information.
 
 
-from typing import TypedDict, Optional, List, Annotated
+from dataclasses import dataclass, field
+from typing import Optional, List, Annotated
 from langgraph.graph.message import add_messages
 from langchain_core.messages import BaseMessage
 
 
-class BookingState(TypedDict):
-    messages: Annotated[List[BaseMessage], add_messages]
+#Slotted dataclass: fixed attribute offsets instead of per-key dict lookups.
+#LangGraph merges the dict updates returned by nodes field by field.
+@dataclass(slots=True)
+class BookingState:
+    messages: Annotated[List[BaseMessage], add_messages] = field(default_factory=list)
 
     # Booking information
-    restaurant_name: Optional[str]
-    date: Optional[str]
-    time: Optional[str]
-    party_size: Optional[int]
-    customer_name: Optional[str]
-    phone: Optional[str]
-    booking_ref: Optional[str]
+    restaurant_name: Optional[str] = None
+    date: Optional[str] = None
+    time: Optional[str] = None
+    party_size: Optional[int] = None
+    customer_name: Optional[str] = None
+    phone: Optional[str] = None
+    booking_ref: Optional[str] = None
 
     # Control flags
-    all_info_collected: bool
-    awaiting_confirmation: bool
-    user_confirmed: bool
-    conversation_complete: bool
+    all_info_collected: bool = False
+    awaiting_confirmation: bool = False
+    user_confirmed: bool = False
+    sms_sent: bool = False
+    conversation_complete: bool = False
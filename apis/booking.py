@@ -1,15 +1,74 @@
 #Mock Booking API for restaurant reservations.
 
 
+import asyncio
+import copy
+import logging
 import random
-from typing import Dict, Any
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
 
 BOOKING_FAILURE_RATE = 0.05  # 5% random failure rate --> for testing mainly
 BOOKING_REF_MIN = 10000
 BOOKING_REF_MAX = 99999
+BOOKING_MAX_ATTEMPTS = 3
+BOOKING_RETRY_BASE_DELAY = 0.1  # seconds, doubled per attempt with full jitter
+BOOKING_CACHE_MAX_SIZE = 128
+BOOKING_CACHE_TTL = 60.0  # seconds a successful booking is reused for identical requests
+
+
+# Module-private generator; failure draws are a 16-bit integer compare
+_rng = random.Random()
+_FAILURE_THRESHOLD = int(BOOKING_FAILURE_RATE * 65536)
+_ID_SPAN = BOOKING_REF_MAX - BOOKING_REF_MIN + 1
+
+# Recent successful bookings keyed on their inputs, so resubmitting the same booking
+# within BOOKING_CACHE_TTL returns the original reference instead of creating a
+# duplicate. Entries are (stored_at, result) in insertion order, which is also expiry
+# order; failures are never stored.
+_booking_cache: "OrderedDict[tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+# Retry transient failures with exponential backoff before reporting an error
+async def create_booking(
+    restaurant: str,
+    date: str,
+    time: str,
+    party_size: int,
+    name: str,
+    phone: str,
+    simulate_failure: bool = False
+) -> Dict[str, Any]:
+
+    key = (restaurant, date, time, party_size, name, phone)
+    now = monotonic()
+    while _booking_cache and now - next(iter(_booking_cache.values()))[0] > BOOKING_CACHE_TTL:
+        _booking_cache.popitem(last=False)
+
+    cached = _booking_cache.get(key)
+    if cached is not None and not simulate_failure:
+        # Copy so callers can't mutate the stored result
+        return copy.deepcopy(cached[1])
 
+    for attempt in range(BOOKING_MAX_ATTEMPTS):
+        result = await _create_booking_once(
+            restaurant, date, time, party_size, name, phone, simulate_failure
+        )
+        if result["success"] or attempt == BOOKING_MAX_ATTEMPTS - 1:
+            break
+        await asyncio.sleep(BOOKING_RETRY_BASE_DELAY * 2**attempt * _rng.random())
 
-def create_booking(
+    if result["success"]:
+        _booking_cache[key] = (monotonic(), copy.deepcopy(result))
+        if len(_booking_cache) > BOOKING_CACHE_MAX_SIZE:
+            _booking_cache.popitem(last=False)
+
+    return result
+
+
+async def _create_booking_once(
     restaurant: str,
     date: str,
     time: str,
@@ -19,8 +78,11 @@ def create_booking(
     simulate_failure: bool = False
 ) -> Dict[str, Any]:
 
+    # Yield to the event loop like a real network call would
+    await asyncio.sleep(0)
+
     # Simulate random failures or forced failure for testing 
-    if simulate_failure or restaurant == "Test Failure Restaurant" or random.random() < BOOKING_FAILURE_RATE:
+    if simulate_failure or restaurant == "Test Failure Restaurant" or _rng.getrandbits(16) < _FAILURE_THRESHOLD:
         return {
             "success": False,
             "error": "Unable to connect to booking system. Please try again.",
@@ -28,19 +90,12 @@ def create_booking(
         }
 
     # Generate booking reference
-    booking_ref = f"BK-{random.randint(BOOKING_REF_MIN, BOOKING_REF_MAX)}"
-
-    print(f"\n{'='*60}")
-    print(f"BOOKING CREATED SUCCESSFULLY")
-    print(f"{'='*60}")
-    print(f"Reference: {booking_ref}")
-    print(f"Restaurant: {restaurant}")
-    print(f"Date: {date}")
-    print(f"Time: {time}")
-    print(f"Party Size: {party_size}")
-    print(f"Name: {name}")
-    print(f"Phone: {phone}")
-    print(f"{'='*60}\n")
+    booking_ref = f"BK-{BOOKING_REF_MIN + _rng.getrandbits(17) % _ID_SPAN}"
+
+    logger.info(
+        "BOOKING CREATED ref=%s restaurant=%s date=%s time=%s party_size=%s name=%s phone=%s",
+        booking_ref, restaurant, date, time, party_size, name, phone
+    )
 
     return {
         "success": True,
@@ -1,33 +1,48 @@
 #Mock SMS API for sending confirmation messages.
 
+import asyncio
+import logging
 import random
 from typing import Dict, Any
 
+logger = logging.getLogger(__name__)
 
 SMS_FAILURE_RATE = 0.03  # 3% random failure rate
 MESSAGE_ID_MIN = 10000
 MESSAGE_ID_MAX = 99999
+SMS_MAX_ATTEMPTS = 3
+SMS_RETRY_BASE_DELAY = 0.1  # seconds, doubled per attempt with full jitter
+
+# Module-private generator; failure draws are a 16-bit integer compare
+_rng = random.Random()
+_FAILURE_THRESHOLD = int(SMS_FAILURE_RATE * 65536)
+_ID_SPAN = MESSAGE_ID_MAX - MESSAGE_ID_MIN + 1
+
+# Retry transient failures with exponential backoff before reporting an error
+async def send_sms(phone: str, message: str, simulate_failure: bool = False) -> Dict[str, Any]:
+
+    for attempt in range(SMS_MAX_ATTEMPTS):
+        result = await _send_sms_once(phone, message, simulate_failure)
+        if result["success"] or attempt == SMS_MAX_ATTEMPTS - 1:
+            return result
+        await asyncio.sleep(SMS_RETRY_BASE_DELAY * 2**attempt * _rng.random())
 
 # Simulate random failures or forced failure
-def send_sms(phone: str, message: str, simulate_failure: bool = False) -> Dict[str, Any]:
+async def _send_sms_once(phone: str, message: str, simulate_failure: bool) -> Dict[str, Any]:
+
+    # Yield to the event loop like a real network call would
+    await asyncio.sleep(0)
 
-    if simulate_failure or phone == "555-SMS-FAIL" or random.random() < SMS_FAILURE_RATE:
+    if simulate_failure or phone == "555-SMS-FAIL" or _rng.getrandbits(16) < _FAILURE_THRESHOLD:
         return {
             "success": False,
             "error": "SMS service temporarily unavailable.",
             "message_id": None
         }
 
-    message_id = f"SMS-{random.randint(MESSAGE_ID_MIN, MESSAGE_ID_MAX)}"
+    message_id = f"SMS-{MESSAGE_ID_MIN + _rng.getrandbits(17) % _ID_SPAN}"
 
-    print(f"\n{'='*60}")
-    print(f"SMS SENT SUCCESSFULLY")
-    print(f"{'='*60}")
-    print(f"To: {phone}")
-    print(f"Message ID: {message_id}")
-    print(f"\nMessage:")
-    print(f"{message}")
-    print(f"{'='*60}\n")
+    logger.info("SMS SENT to=%s message_id=%s message=%r", phone, message_id, message)
 
     return {
         "success": True,
@@ -3,22 +3,84 @@ Restaurant Booking Agent - Main Entry Point
 Interactive CLI for conversational restaurant bookings.
 """
 
+import asyncio
 import os
+import select
+import sys
 import uuid
 from dotenv import load_dotenv
 from langchain_core.messages import HumanMessage
 
+# Load environment variables once, before the agent modules read them at import
+load_dotenv()
+
 from agent.graph import build_graph
 from agent.state import BookingState
 
 
+# Shown at the start of every session
+GREETING = """Hello! I'm your restaurant booking assistant.
+
+I can help you make a reservation. I'll need to collect a few details:
+- Restaurant name
+- Date and time
+- Party size (number of people)
+- Your name
+- Your phone number
+
+Let's get started! What restaurant would you like to book?"""
+
+# Poll without waiting: pasted lines are already buffered when input() returns,
+# so a normal one-line turn isn't delayed
+INPUT_BATCH_WINDOW = 0
+
+
 def print_separator():
     print("\n" + "="*60 + "\n")
 
+#Read one line, then drain any lines already waiting so a paste becomes one turn
+def read_user_input(prompt: str) -> str:
+    lines = [input(prompt)]
+
+    try:
+        while select.select([sys.stdin], [], [], INPUT_BATCH_WINDOW)[0]:
+            line = sys.stdin.readline()
+            if not line:
+                break
+            lines.append(line.rstrip("\n"))
+    except (OSError, ValueError):
+        # select() on stdin isn't supported everywhere (e.g. Windows consoles)
+        pass
+
+    return "\n".join(lines)
+
+#Run one turn through the graph, printing the agent's reply as it streams in.
+#Only the new user message is sent; the checkpointer holds the rest of the session.
+async def run_turn(app, user_input: str, session_id: str):
+    streamed = []
+    final_state = None
+    config = {"configurable": {"thread_id": session_id}}
+
+    async for mode, chunk in app.astream(
+        {"messages": [HumanMessage(content=user_input)]},
+        config,
+        stream_mode=["custom", "values"]
+    ):
+        if mode == "custom":
+            if not streamed:
+                print("\nAgent: ", end="", flush=True)
+            print(chunk["response_delta"], end="", flush=True)
+            streamed.append(chunk["response_delta"])
+        else:
+            final_state = BookingState(**chunk)
+
+    if streamed:
+        print()
+
+    return final_state, "".join(streamed)
+
 #Run the restaurant booking agent 
 def run_agent():
-    
-    load_dotenv()
 
     if not os.getenv("OPENAI_API_KEY"):
         print("Error: OPENAI_API_KEY not found in .env file")
@@ -33,46 +95,18 @@ def run_agent():
     app = build_graph()
     print("Agent ready!\n")
 
-    # Generate session ID for tracing
+    # Generate session ID for tracing; it is also the checkpointer thread holding state
     session_id = str(uuid.uuid4())
     print(f"[LANGFUSE] Session ID: {session_id}")
 
-    # Initialize state
-    state: BookingState = {
-        "messages": [],
-        "restaurant_name": None,
-        "date": None,
-        "time": None,
-        "party_size": None,
-        "customer_name": None,
-        "phone": None,
-        "booking_ref": None,
-        "all_info_collected": False,
-        "awaiting_confirmation": False,
-        "user_confirmed": False,
-        "conversation_complete": False
-    }
-
-  
-    greeting = """Hello! I'm your restaurant booking assistant.
-
-I can help you make a reservation. I'll need to collect a few details:
-- Restaurant name
-- Date and time
-- Party size (number of people)
-- Your name
-- Your phone number
-
-Let's get started! What restaurant would you like to book?"""
-
-    print("Agent:", greeting)
+    print("Agent:", GREETING)
 
     # Main conversation loop
     while True:
         print_separator()
 
-        # Get user input
-        user_input = input("You: ").strip()
+        # Get user input (pasted multi-line input is batched into one message)
+        user_input = read_user_input("You: ").strip()
 
         if not user_input:
             print("(Please enter a message)")
@@ -83,23 +117,21 @@ Let's get started! What restaurant would you like to book?"""
             print("\nThank you for using the restaurant booking agent! Goodbye!\n")
             break
 
-        # Add user message to state
-        state["messages"].append(HumanMessage(content=user_input))
-
         # Process with agent
         try:
-            state = app.invoke(state)
+            state, streamed_response = asyncio.run(run_turn(app, user_input, session_id))
 
-            # Get agent response
-            agent_response = state["messages"][-1].content
-            print(f"\nAgent: {agent_response}")
+            # Print the final response unless it was already streamed
+            agent_response = state.messages[-1].content
+            if agent_response != streamed_response:
+                print(f"\nAgent: {agent_response}")
 
             # Check if conversation ended
-            if state.get("conversation_complete"):
+            if state.conversation_complete:
                     print_separator()
                     print("Booking complete and saved!")
-                    if state.get("booking_ref"):
-                        print(f"Your booking reference is: {state['booking_ref']}")
+                    if state.booking_ref:
+                        print(f"Your booking reference is: {state.booking_ref}")
 
                     # Ask if user wants to make another booking
                     print("\nYour current booking is confirmed.")
@@ -116,24 +148,11 @@ Let's get started! What restaurant would you like to book?"""
                         # Log session completion
                         print(f"[LANGFUSE] Session {session_id}: COMPLETED")
                         
-                        # Reset state for new booking
+                        # Reset state for new booking (a new session ID starts a fresh thread)
+                        app.checkpointer.delete_thread(session_id)
                         session_id = str(uuid.uuid4())  # New session ID
                         print(f"[LANGFUSE] New Session ID: {session_id}")
-                        state = {
-                            "messages": [],
-                            "restaurant_name": None,
-                            "date": None,
-                            "time": None,
-                            "party_size": None,
-                            "customer_name": None,
-                            "phone": None,
-                            "booking_ref": None,
-                            "all_info_collected": False,
-                            "awaiting_confirmation": False,
-                            "user_confirmed": False,
-                            "conversation_complete": False
-                        }
-                        print("\nAgent:", greeting)
+                        print("\nAgent:", GREETING)
                     else:
                         # Log session completion
                         print(f"[LANGFUSE] Session {session_id}: COMPLETED")
@@ -1,14 +1,12 @@
+import asyncio
 import streamlit as st
+import time
 import uuid
 from dotenv import load_dotenv
 from langchain_core.messages import HumanMessage, AIMessage
 
-from agent.graph import build_graph
 from agent.state import BookingState
 
-# Load environment variables
-load_dotenv()
-
 # PAGE CONFIGURATION
 
 st.set_page_config(
@@ -20,111 +18,136 @@ st.title("Restaurant Booking Agent")
 st.write("Interactive AI assistant for restaurant reservations")
 
 
+# Built once at import instead of on every script rerun
+_GREETING = """Hello! I'm your restaurant booking assistant.
+
+I can help you make a reservation. I'll need to collect a few details:
+- Restaurant name
+- Date and time
+- Party size (number of people)
+- Your name
+- Your phone number
+
+Let's get started! What restaurant would you like to book?"""
+
+
+def _fresh_booking_state():
+    """Return a new blank booking state; the dataclass defaults give it its own message list."""
+    return BookingState()
+
+
+# Number of most recent messages rendered outside the "Earlier messages" expander
+HISTORY_WINDOW = 50
+
+
+def _render_messages(roles, contents):
+    """Render chat messages as user/assistant bubbles."""
+    for role, content in zip(roles, contents):
+        with st.chat_message(role):
+            st.write(content)
+
+
+def _append_message(role, content):
+    """Append a chat entry to the parallel role/content/timestamp columns."""
+    st.session_state.roles.append(role)
+    st.session_state.contents.append(content)
+    st.session_state.timestamps.append(time.monotonic_ns())
+
+
+def _clear_messages():
+    """Reset the conversation columns."""
+    st.session_state.roles = []
+    st.session_state.contents = []
+    st.session_state.timestamps = []
+
+
+# Sidebar label and BookingState attribute for each booking field, in display order
+_FIELD_LABELS = (
+    ("Restaurant", "restaurant_name"),
+    ("Date", "date"),
+    ("Time", "time"),
+    ("Party Size", "party_size"),
+    ("Name", "customer_name"),
+    ("Phone", "phone"),
+)
+
+
+@st.cache_data(ttl=None)
+def _booking_summary(snapshot):
+    """Format the sidebar booking fields; cached on the field values so unchanged reruns reuse it."""
+    return "\n\n".join(
+        f"**{label}:** {value or 'Missing'}"
+        for (label, _), value in zip(_FIELD_LABELS, snapshot)
+    )
+
+
+# Minimum gap between placeholder updates while a reply streams in
+STREAM_FLUSH_SECONDS = 0.05
+
+
+async def _stream_turn(app, user_input, config, placeholder):
+    """Run one turn, writing the streamed reply into placeholder; returns the final state."""
+    buf = []
+    last_flush = 0.0
+    final_state = None
+
+    async for mode, chunk in app.astream(
+        {"messages": [HumanMessage(content=user_input)]},
+        config,
+        stream_mode=["custom", "values"]
+    ):
+        if mode == "custom":
+            buf.append(chunk["response_delta"])
+            now = time.monotonic()
+            if now - last_flush > STREAM_FLUSH_SECONDS:
+                placeholder.markdown("".join(buf))
+                last_flush = now
+        else:
+            final_state = chunk
+
+    return final_state
+
+
 # SESSION STATE INITIALIZATION
-if 'conversation_history' not in st.session_state:
-    st.session_state.conversation_history = []
+# Conversation is stored column-wise (struct of arrays): parallel lists of roles,
+# contents and monotonic_ns timestamps instead of one dict per message
+if 'roles' not in st.session_state:
+    _clear_messages()
 
 if 'booking_state' not in st.session_state:
-    st.session_state.booking_state = {
-        "messages": [],
-        "restaurant_name": None,
-        "date": None,
-        "time": None,
-        "party_size": None,
-        "customer_name": None,
-        "phone": None,
-        "booking_ref": None,
-        "all_info_collected": False,
-        "awaiting_confirmation": False,
-        "user_confirmed": False,
-        "conversation_complete": False
-    }
+    st.session_state.booking_state = _fresh_booking_state()
 
 if 'session_id' not in st.session_state:
     st.session_state.session_id = str(uuid.uuid4())
 
-if 'agent_initialized' not in st.session_state:
-    st.session_state.agent_initialized = False
-    st.session_state.app = None
-
 # AGENT INITIALIZATION
 
-@st.cache_resource
+@st.cache_resource(show_spinner="Initializing booking agent...")
 def initialize_agent():
-    """Initialize the booking agent."""
-    return build_graph()
+    """Initialize the booking agent once per process; returns it with the opening greeting."""
+    # Load .env once per process, before the agent modules read it at import.
+    # Imported here so the page renders before the LLM/graph modules load
+    load_dotenv()
+    from agent.graph import build_graph
+    return build_graph(), _GREETING
 
-if not st.session_state.agent_initialized:
-    with st.spinner("Initializing booking agent..."):
-        st.session_state.app = initialize_agent()
-        st.session_state.agent_initialized = True
-        
-        # Add initial greeting to conversation
-        greeting = """Hello! I'm your restaurant booking assistant.
+app, greeting = initialize_agent()
 
-I can help you make a reservation. I'll need to collect a few details:
-- Restaurant name
-- Date and time
-- Party size (number of people)
-- Your name
-- Your phone number
+# Greet every new conversation, including the one started by "New Booking"
+if not st.session_state.roles:
+    _append_message("assistant", greeting)
 
-Let's get started! What restaurant would you like to book?"""
-        
-        st.session_state.conversation_history.append({
-            "role": "assistant", 
-            "content": greeting,
-            "timestamp": st.session_state.session_id
-        })
 
+# USER INPUT
+# Read before rendering so the new message appears, and the reply streams in below
+# it, within this script run (no follow-up st.rerun())
 
-# SIDEBAR - BOOKING STATUS
-with st.sidebar:
-    st.header("Booking Status")
-    
-    booking_info = {
-        "Restaurant": st.session_state.booking_state.get("restaurant_name") or "Missing",
-        "Date": st.session_state.booking_state.get("date") or "Missing", 
-        "Time": st.session_state.booking_state.get("time") or "Missing",
-        "Party Size": st.session_state.booking_state.get("party_size") or "Missing",
-        "Name": st.session_state.booking_state.get("customer_name") or "Missing",
-        "Phone": st.session_state.booking_state.get("phone") or "Missing"
-    }
-    
-    for key, value in booking_info.items():
-        if value == "Missing":
-            st.write(f"**{key}:** {value}")
-        else:
-            st.write(f"**{key}:** {value}")
-    
-    # Booking reference if available
-    if st.session_state.booking_state.get("booking_ref"):
-        st.success(f"**Booking Confirmed!**\nRef: {st.session_state.booking_state['booking_ref']}")
-    
-    # Session info
-    st.write("---")
-    st.caption(f"Session: {st.session_state.session_id[:8]}...")
-    st.caption(f"Messages: {len(st.session_state.conversation_history)}")
-    
-    # Reset button
-    if st.button("New Booking"):
-        st.session_state.conversation_history = []
-        st.session_state.booking_state = {
-            "messages": [],
-            "restaurant_name": None,
-            "date": None,
-            "time": None,
-            "party_size": None,
-            "customer_name": None,
-            "phone": None,
-            "booking_ref": None,
-            "all_info_collected": False,
-            "awaiting_confirmation": False,
-            "user_confirmed": False,
-            "conversation_complete": False
-        }
-        st.session_state.session_id = str(uuid.uuid4())
-        st.rerun()
+# Chat input
+user_input = st.chat_input("Type your message here...")
+
+if user_input:
+    # Add user message to conversation
+    _append_message("user", user_input)
 
 
 # MAIN CONVERSATION INTERFACE
@@ -136,54 +159,75 @@ st.header("Conversation")
 conversation_container = st.container()
 
 with conversation_container:
-    for i, message in enumerate(st.session_state.conversation_history):
-        if message["role"] == "user":
-            with st.chat_message("user"):
-                st.write(message["content"])
-        else:  # assistant
-            with st.chat_message("assistant"):
-                st.write(message["content"])
+    roles = st.session_state.roles
+    contents = st.session_state.contents
+    earlier = len(roles) - HISTORY_WINDOW
 
-# USER INPUT 
+    # Older messages stay collapsed and are only built while the expander is open,
+    # so each rerun otherwise rebuilds just the recent window
+    if earlier > 0:
+        with st.expander(f"Earlier messages ({earlier})", key="earlier_messages", on_change="rerun") as older:
+            if older.open:
+                _render_messages(roles[:earlier], contents[:earlier])
 
-# Chat input
-user_input = st.chat_input("Type your message here...")
+    _render_messages(roles[-HISTORY_WINDOW:], contents[-HISTORY_WINDOW:])
 
 if user_input:
-    # Add user message to conversation
-    st.session_state.conversation_history.append({
-        "role": "user",
-        "content": user_input,
-        "timestamp": st.session_state.session_id
-    })
-    
-    # Add to booking state messages
-    st.session_state.booking_state["messages"].append(HumanMessage(content=user_input))
-    
     # Process with agent
     try:
+        with st.chat_message("assistant"):
+            placeholder = st.empty()
+
         with st.spinner("Processing..."):
-            # Invoke the agent
-            updated_state = st.session_state.app.invoke(st.session_state.booking_state)
+            # Stream just the new message; the graph's checkpointer keeps the rest
+            # of the session under this thread_id
+            updated_state = asyncio.run(_stream_turn(
+                app,
+                user_input,
+                {"configurable": {"thread_id": st.session_state.session_id}},
+                placeholder
+            ))
             
             # Update booking state
-            st.session_state.booking_state = updated_state
+            st.session_state.booking_state = BookingState(**updated_state)
             
             # Get agent response
             if updated_state["messages"]:
                 agent_response = updated_state["messages"][-1].content
+                placeholder.markdown(agent_response)
                 
                 # Add agent response to conversation
-                st.session_state.conversation_history.append({
-                    "role": "assistant",
-                    "content": agent_response,
-                    "timestamp": st.session_state.session_id
-                })
-        
-        # Rerun to update the display
-        st.rerun()
+                _append_message("assistant", agent_response)
         
     except Exception as e:
         st.error(f"Error processing request: {str(e)}")
         st.error("Please try again or refresh the page.")
 
+
+# SIDEBAR - BOOKING STATUS
+with st.sidebar:
+    st.header("Booking Status")
+    
+    booking_state = st.session_state.booking_state
+    snapshot = tuple(getattr(booking_state, key) for _, key in _FIELD_LABELS)
+    st.markdown(_booking_summary(snapshot))
+    
+    # Booking reference if available
+    if booking_state.booking_ref:
+        st.success(f"**Booking Confirmed!**\nRef: {booking_state.booking_ref}")
+    
+    # Session info
+    st.write("---")
+    st.caption(f"Session: {st.session_state.session_id[:8]}...")
+    st.caption(f"Messages: {len(st.session_state.roles)}")
+    if len(st.session_state.timestamps) > 1:
+        timestamps = st.session_state.timestamps
+        st.caption(f"Duration: {(timestamps[-1] - timestamps[0]) / 1e9:.1f}s")
+    
+    # Reset button
+    if st.button("New Booking"):
+        _clear_messages()
+        st.session_state.booking_state = _fresh_booking_state()
+        app.checkpointer.delete_thread(st.session_state.session_id)
+        st.session_state.session_id = str(uuid.uuid4())
+        st.rerun()
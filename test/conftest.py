@@ -0,0 +1,25 @@
+#Shared pytest fixtures for restaurant booking agent tests.
+
+import pytest
+
+from test_helpers import create_complete_booking_state
+
+
+@pytest.fixture
+def complete_state():
+    """A BookingState with every booking field filled, ready for the booking/SMS nodes."""
+    return create_complete_booking_state()
+
+
+@pytest.fixture(scope="session")
+def graph():
+    """The compiled booking graph, built once and shared by every test in the session."""
+    from agent.graph import build_graph
+    return build_graph()
+
+
+@pytest.fixture(autouse=True)
+def clear_booking_cache():
+    """Start every test without bookings remembered from earlier tests."""
+    from apis.booking import _booking_cache
+    _booking_cache.clear()
@@ -4,6 +4,34 @@ from agent.state import BookingState
 from langchain_core.messages import HumanMessage, AIMessage
 
 
+# Built once per test session; each helper call copies these and adds a fresh message list
+_DEFAULTS = {
+    "restaurant_name": None,
+    "date": None,
+    "time": None,
+    "party_size": None,
+    "customer_name": None,
+    "phone": None,
+    "booking_ref": None,
+    "all_info_collected": False,
+    "awaiting_confirmation": False,
+    "user_confirmed": False,
+    "sms_sent": False,
+    "conversation_complete": False
+}
+
+_COMPLETE = {
+    **_DEFAULTS,
+    "restaurant_name": "Mario's Italian",
+    "date": "2025-12-01",
+    "time": "19:00",
+    "party_size": 4,
+    "customer_name": "John Doe",
+    "phone": "555-1234",
+    "all_info_collected": True
+}
+
+
 def create_booking_state(**overrides) -> BookingState:
     """Create a BookingState with default values and optional overrides.
     
@@ -13,25 +41,7 @@ def create_booking_state(**overrides) -> BookingState:
     Returns:
         BookingState with defaults applied
     """
-    defaults = {
-        "messages": [],
-        "restaurant_name": None,
-        "date": None,
-        "time": None,
-        "party_size": None,
-        "customer_name": None,
-        "phone": None,
-        "booking_ref": None,
-        "all_info_collected": False,
-        "awaiting_confirmation": False,
-        "user_confirmed": False,
-        "conversation_complete": False
-    }
-    
-    # Apply overrides
-    defaults.update(overrides)
-    
-    return BookingState(**defaults)
+    return BookingState(**{**_DEFAULTS, "messages": [], **overrides})
 
 
 def create_complete_booking_state(**overrides) -> BookingState:
@@ -43,22 +53,4 @@ def create_complete_booking_state(**overrides) -> BookingState:
     Returns:
         Complete BookingState ready for confirmation
     """
-    complete_data = {
-        "messages": [],
-        "restaurant_name": "Mario's Italian",
-        "date": "2025-12-01",
-        "time": "19:00",
-        "party_size": 4,
-        "customer_name": "John Doe",
-        "phone": "555-1234",
-        "booking_ref": None,
-        "all_info_collected": True,
-        "awaiting_confirmation": False,
-        "user_confirmed": False,
-        "conversation_complete": False
-    }
-    
-    # Apply overrides
-    complete_data.update(overrides)
-    
-    return BookingState(**complete_data)
\ No newline at end of file
+    return BookingState(**{**_COMPLETE, "messages": [], **overrides})
\ No newline at end of file